@@ -1,22 +1,51 @@
 import pandas as pd
 import numpy as np
+import html
+import os
 import random
+import re
 import requests
 import time
 from bs4 import BeautifulSoup
-from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# One keep-alive session shared by all the scraping threads, so every hero page reuses an open connection
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+# Seconds to wait on a connection or a read before giving up on a page
+request_timeout = 10
+# The roles sit in a single <p id="heroBioRoles"> element, a regex finds it without building the whole html tree
+hero_roles_pattern = re.compile(rb'<p(?:\s[^>]*)?\sid=["\']heroBioRoles["\'][^>]*>([^<]+)</p>', re.I)
 
 def assign_player_team(players_df):
     '''
     Input: player info dataframe
-    Output: one extra column (radiant_player) indicating the player team, Radiant=True and Dire=False
+    Output: one extra column (radiant_player) indicating the player team, Radiant=True and Dire=False, and
+            one extra column (match_row) giving the row of the player's match in every per-match feature DataFrame
     '''
     players_df['radiant_player'] = players_df['player_slot'] < 50
+    # Factorizing the match_id once here saves every per-match scatter further down from rebuilding the same mapping
+    match_rows, _ = pd.factorize(players_df['match_id'], sort=True)
+    players_df['match_row'] = match_rows.astype(np.int32)
     return players_df
 
+def get_match_rows(players_df):
+    '''
+    Input: player info dataframe
+    Output: the row of every player's match, reused from the match_row column of assign_player_team when present and
+            factorized from match_id otherwise. match_row goes stale if players_df is filtered afterwards, so call
+            assign_player_team again in that case
+    '''
+    if 'match_row' in players_df.columns:
+        return players_df['match_row'].values
+    match_rows, _ = pd.factorize(players_df['match_id'], sort=True)
+    return match_rows
+
 def construct_hero_selection_df(players_df, heros_chart):
     '''
-    Input: player info dataframe and heros info dataframe
+    Input: player info dataframe and heros info dataframe, match rows come from get_match_rows
     Output: hero_selection_df that gives 1 for every selected hero, and 0 otherwise for every game(row)
     '''
     # Quick function to help me get nice snake form hero names from the name column in heros_chart
@@ -29,30 +58,21 @@ def construct_hero_selection_df(players_df, heros_chart):
     dire_heros = hero_names.apply(lambda x: x + '_dire').tolist()
     hero_two_teams = radiant_heros + dire_heros
 
-    hero_selection_raw = players_df.groupby('match_id').apply(get_hero_selection, num_heros=num_heros).apply(pd.Series).values
+    # Scatter every pick straight into a preallocated matrix: the row is the match, the column is the hero shifted by
+    # num_heros for dire players. Must subtract hero_id by 1 because they start from 1 to 112, index start 1 lower
+    match_rows = get_match_rows(players_df)
+    hero_cols = (players_df['hero_id'].values - 1) + num_heros * (~players_df['radiant_player'].values).astype(np.intp)
+    hero_selection_raw = np.zeros((match_rows.max() + 1, 2 * num_heros), dtype=np.uint8)
+    hero_selection_raw[match_rows, hero_cols] = 1
     return pd.DataFrame(data=hero_selection_raw, index=range(50000), columns=hero_two_teams)
 
-def get_hero_selection(single_game_player_info, num_heros):
-    '''
-    Input: player info from a single game
-    Output: one row of NumPy array representing the hero selection by both teams
-    '''
-    hero_selection_row = np.zeros(2 * num_heros)
-    # Must subtract hero_id by 1 because they start from 1 to 112, index start 1 lower
-    radiant_heros = single_game_player_info[single_game_player_info.radiant_player].hero_id.values - 1
-    dire_heros = single_game_player_info[~single_game_player_info.radiant_player].hero_id.values + num_heros - 1
-
-    hero_selections = np.append(radiant_heros, dire_heros)
-    hero_selection_row[hero_selections] = 1
-    return hero_selection_row
-
 def construct_x_seconds_df(players_time_df, threshold=600):
     '''
     Input: player info dataframe
     Output: all player info before the desired time threshold, defaulted to be 10 minutes/600 seconds
     '''
-    x_seconds_df = players_time_df.groupby('match_id').apply(lambda game: game[game.times <= threshold])
-    x_seconds_df.reset_index(drop=True, inplace=True)
+    # The filter does not depend on the match, so a single boolean mask over the times column is enough
+    x_seconds_df = players_time_df.loc[players_time_df['times'].values <= threshold].reset_index(drop=True)
     return x_seconds_df
 
 def construct_x_seconds_max_wealth(x_seconds_df):
@@ -69,13 +89,18 @@ def construct_x_seconds_gold_growth_benchmark(x_seconds_df):
     Output: the mean, std of gold growth before 10 minutes
     '''
     # Thanks to a well-structured player info dataframe, I can refer to all gold columns quickly
-    gold_growth_df = x_seconds_df.iloc[:, 2::3].diff().join(x_seconds_df.match_id)
+    gold_columns = x_seconds_df.columns[2::3].tolist()
+    gold = x_seconds_df[gold_columns].values.astype(np.float64)
+    gold_growth = np.full_like(gold, np.nan)
+    gold_growth[1:] = np.diff(gold, axis=0)
+    # The first row of every match diffs against the end of the previous match and comes out negative, filter it out.
     # Subtracting 100 from each minute-to-minute gold growth to normalize for actual gold growth
-    gold_growth_df = gold_growth_df[(gold_growth_df.iloc[:, 0]>=0)] - 100
-    gold_growth_df['match_id'] += 100
+    kept_rows = gold_growth[:, 0] >= 0
+    gold_growth_df = pd.DataFrame(gold_growth[kept_rows] - 100, columns=gold_columns)
+    gold_growth_by_match = gold_growth_df.groupby(pd.Index(x_seconds_df['match_id'].values[kept_rows], name='match_id'))
 
-    gold_growth_mean = gold_growth_df.groupby('match_id').mean()
-    gold_growth_std = gold_growth_df.groupby('match_id').std()
+    gold_growth_mean = gold_growth_by_match.mean()
+    gold_growth_std = gold_growth_by_match.std()
     return gold_growth_mean.join(gold_growth_std, lsuffix='_mean', rsuffix='_std')
 
 def construct_num_team_fights(team_fights_df, threshold=600):
@@ -83,45 +108,34 @@ def construct_num_team_fights(team_fights_df, threshold=600):
     Input: team fight info before desired time threshold
     Output: the number of team fights for every match in a dataframe
     '''
-    num_team_fights_df = pd.DataFrame(team_fights_df[team_fights_df.end < threshold].groupby('match_id')['start'].count())
-    num_team_fights_df = num_team_fights_df.rename(columns={'start': 'count'})
-    return pd.DataFrame(index=range(50000)).join(num_team_fights_df).fillna(0).astype(int)
+    before_threshold = team_fights_df['end'].values < threshold
+    # Matches without any team fight before the threshold are missing from value_counts, reindex fills them with 0
+    num_team_fights = pd.Series(team_fights_df['match_id'].values[before_threshold]).value_counts()
+    return num_team_fights.reindex(range(50000), fill_value=0).astype(np.int16).to_frame('count')
 
 def construct_net_death_count_from_teamfights(teamfight_players_df, num_team_fights_df):
     '''
     Input: teamfight info for players by match, number of teamfights before 10 mins by match
     Output: net death count for radiant and dire players from all teamfights before 10 mins in each match
     '''
-    team_fights_before_ten_min_raw = teamfight_players_df.groupby('match_id')\
-                                    .apply(get_net_death_count, num_team_fights_df=num_team_fights_df)
-    # The missing_index is very important here, as it captures matches where no team fights happened(abandoned).
-    # In this case, groupby('match_id') will not give us those matches, so we have to fill them in manually with missing_index
-    missing_index = np.array(list(set(range(50000)) - set(team_fights_before_ten_min_raw.index)))
-    team_fights_before_ten_min_raw = team_fights_before_ten_min_raw.reindex(index=range(50000), fill_value=[0, 0])
-    return pd.DataFrame(team_fights_before_ten_min_raw.apply(pd.Series).values, index=range(50000),
-                        columns=['radiant_net_death_count', 'dire_net_death_count'])
-
-def get_net_death_count(single_game_teamfight_info, num_team_fights_df):
-    '''
-    Input: teamfight info for a single match, number of teamfights before 10 mins by match
-    Output: net death count for radiant and dire players from all teamfights before 10 mins in that single match
-    '''
-    match_id = int(single_game_teamfight_info['match_id'].mean())
-    num_teamfights = num_team_fights_df.iloc[match_id, 0]
-    teamfights_before_ten_min = single_game_teamfight_info.reset_index(drop=True).iloc[:num_teamfights*10 - 1]
-    if teamfights_before_ten_min.shape[0] == 0:
-        return [0, 0]
-    radiant_net_death_count = teamfights_before_ten_min[teamfights_before_ten_min.player_slot<50]['deaths'].sum()
-    dire_net_death_count = teamfights_before_ten_min[teamfights_before_ten_min.player_slot >50]['deaths'].sum()
-    return [radiant_net_death_count, dire_net_death_count]
+    # Every teamfight has 10 player rows, so the teamfights before 10 mins are simply the first rows of each match
+    teamfights = teamfight_players_df.merge(num_team_fights_df.rename(columns={'count': 'num_teamfights'}),
+                                            left_on='match_id', right_index=True)
+    teamfight_row = teamfights.groupby('match_id').cumcount().values
+    teamfights = teamfights[teamfight_row < teamfights['num_teamfights'].values * 10 - 1]
+    # Matches where no team fights happened(abandoned) will not show up in the groupby, so reindex fills them with 0
+    radiant_net_death_count = teamfights[teamfights.player_slot < 50].groupby('match_id')['deaths'].sum()
+    dire_net_death_count = teamfights[teamfights.player_slot > 50].groupby('match_id')['deaths'].sum()
+    return pd.DataFrame({'radiant_net_death_count': radiant_net_death_count.reindex(range(50000), fill_value=0),
+                         'dire_net_death_count': dire_net_death_count.reindex(range(50000), fill_value=0)})
 
 def get_hero_index_mapping(heros_chart):
     '''
     Input: hero info dataframe
     Output: a dictionary where the key is the hero name, and the value its index
     '''
-    index_to_hero = heros_chart['localized_name'].apply(lambda name: '_'.join(name.split()).replace("'", "")).to_dict()
-    hero_index_mapping = {hero: index for index, hero in index_to_hero.iteritems()}
+    index_to_hero = heros_chart['localized_name'].str.replace("'", "", regex=False).str.replace(' ', '_', regex=False)
+    hero_index_mapping = dict(zip(index_to_hero.values, index_to_hero.index))
     return hero_index_mapping
 
 def get_hero_roles(link):
@@ -129,78 +143,112 @@ def get_hero_roles(link):
     Input: URL of a hero's DotA 2 webpage
     Output: A list of all roles fulfilled by the selected hero
     '''
-    hero_page = requests.get(link).content
-
-    # Making sure to save all html files for future reference, no one likes a scraper.
-    f = open('heros_html/{}.txt'.format(link.split('/')[-2]), 'w')
-    f.write(hero_page)
-    f.close()
+    # Making sure to save all html files for future reference, no one likes a scraper. Saved pages are never fetched twice
+    hero_page_path = 'heros_html/{}.txt'.format(link.split('/')[-2])
+    if os.path.exists(hero_page_path):
+        with open(hero_page_path, 'rb') as f:
+            saved_hero_page = f.read()
+        try:
+            return parse_hero_roles(saved_hero_page)
+        except AttributeError:
+            # Pages saved by older runs were written before parsing and may not hold the roles, fetch them again
+            os.remove(hero_page_path)
+
+    # The timeout keeps a stalled connection from blocking its scraping thread forever
+    hero_page = session.get(link, timeout=request_timeout).content
+    hero_roles = parse_hero_roles(hero_page)
+    # Only cache a page once its roles are found, otherwise a broken page would be reused by every retry
+    with open(hero_page_path, 'wb') as f:
+        f.write(hero_page)
+    return hero_roles
 
-    hero_info = BeautifulSoup(hero_page, 'html.parser')
+def parse_hero_roles(hero_page):
+    '''
+    Input: html content of a hero's DotA 2 webpage
+    Output: A list of all roles fulfilled by the selected hero
+    '''
+    hero_roles_match = hero_roles_pattern.search(hero_page)
+    if hero_roles_match is not None:
+        return html.unescape(hero_roles_match.group(1).decode('utf-8', errors='replace')).split(' - ')
+    # Falling back to BeautifulSoup whenever the element does not look like the usual markup
+    hero_info = BeautifulSoup(hero_page, 'lxml')
     return hero_info.find('p', id='heroBioRoles').text.split(' - ')
 
+def try_get_hero_roles(link):
+    '''
+    Input: URL of a hero's DotA 2 webpage
+    Output: A list of all roles fulfilled by the selected hero, None if the roles are missing from the page or the
+            request failed, so that the next round retries it
+    '''
+    try:
+        return get_hero_roles(link)
+    except (AttributeError, requests.RequestException):
+        return None
+
 def construct_hero_roles(hero_index_mapping=None):
     '''
     Input: Optional hero_index_mapping
     Output: if no hero_index_mapping is provided, then return dictionary with hero names as keys and\
             list of roles as values. Otherwise, the key will be mapped indexes.
     '''
-    hero_facebook = requests.get('http://www.dota2.com/heroes/')
-    soup = BeautifulSoup(hero_facebook.content, 'html.parser')
+    hero_facebook = session.get('http://www.dota2.com/heroes/', timeout=request_timeout)
+    soup = BeautifulSoup(hero_facebook.content, 'lxml')
     hero_links = [link['href'] for link in soup.find_all('a', class_='heroPickerIconLink')]
     hero_roles = {}
-    # Let the scraping begin
-    while len(hero_roles) != 113:
-        for link in hero_links:
+    # Let the scraping begin, the pages are fetched in parallel and every round only retries the missing heros
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        while len(hero_roles) != 113:
             # Make sure that I do not scrape the same thing twice
-            if link not in hero_roles.keys():
-                try:
-                    hero_roles[link] = get_hero_roles(link)
-                except AttributeError:
-                    continue
-            time.sleep(random.random())
-    for link in hero_roles.keys():
-        hero_roles[link.split('/')[-2]] = hero_roles.pop(link)
+            missing_links = [link for link in hero_links if link not in hero_roles]
+            for link, roles in zip(missing_links, executor.map(try_get_hero_roles, missing_links)):
+                if roles is not None:
+                    hero_roles[link] = roles
+            if len(hero_roles) != 113:
+                time.sleep(random.random())
+    # Re-keying builds new dictionaries, popping keys while iterating over a live keys() view fails on Python 3
+    hero_roles = {link.split('/')[-2]: roles for link, roles in hero_roles.items()}
     if hero_index_mapping:
-        for hero in hero_roles.keys():
-            # The get method here is specifically used to prevent conflict with MonkeyKing, who is not present for the current data
-            hero_roles[hero_index_mapping.get(hero, 112)] = hero_roles.pop(hero)
+        # The get method here is specifically used to prevent conflict with MonkeyKing, who is not present for the current data
+        hero_roles = {hero_index_mapping.get(hero, 112): roles for hero, roles in hero_roles.items()}
     return hero_roles
 
 def construct_hero_composition_df(players_df, hero_attribute_df):
     '''
-    Input: player info dataframe, heros info dataframe and a roles for each hero
+    Input: player info dataframe, heros info dataframe and a roles for each hero, match rows come from get_match_rows
     Output: hero composition for both teams for all games
     '''
     total_roles = hero_attribute_df.columns.tolist()
     roles_both_teams = [role+'_radiant' for role in total_roles] + [role+'_dire' for role in total_roles]
-    hero_compositions = players_df.groupby('match_id').apply(get_game_hero_composition,
-                        hero_attribute_df=hero_attribute_df).apply(pd.Series).values
+    num_heros = hero_attribute_df.shape[0]
+    # One-hot the picks of each team into its own (match, hero) matrix, then a single matrix multiply against the
+    # (hero, role) attribute matrix sums up the roles of the 5 heros on each side
+    match_rows = get_match_rows(players_df)
+    num_matches = match_rows.max() + 1
+    hero_cols = players_df['hero_id'].values - 1
+    radiant_mask = players_df['radiant_player'].values
+    radiant_onehot = np.zeros((num_matches, num_heros), dtype=np.float32)
+    dire_onehot = np.zeros((num_matches, num_heros), dtype=np.float32)
+    np.add.at(radiant_onehot, (match_rows[radiant_mask], hero_cols[radiant_mask]), 1)
+    np.add.at(dire_onehot, (match_rows[~radiant_mask], hero_cols[~radiant_mask]), 1)
+
+    hero_attributes = hero_attribute_df.values.astype(np.float32)
+    # A team has at most 5 heros of a role, so uint8 holds every count
+    hero_compositions = np.hstack([radiant_onehot @ hero_attributes, dire_onehot @ hero_attributes]).astype(np.uint8)
     return pd.DataFrame(data=hero_compositions, index=range(50000), columns=roles_both_teams)
 
-def get_game_hero_composition(single_game_player_info, hero_attribute_df):
-    '''
-    Input: player info from a single game
-    Output: hero compositions for both radiants and dires from the given game
-    '''
-    radiant_heros = single_game_player_info[single_game_player_info.radiant_player]['hero_id']
-    dire_heros = single_game_player_info[~single_game_player_info.radiant_player]['hero_id']
-    return np.array(hero_attribute_df.iloc[radiant_heros].sum().tolist() + hero_attribute_df.iloc[dire_heros].sum().tolist())
-
 def construct_hero_attribute_df(hero_roles):
     '''
     Input: a dictionary with hero indexes as keys and lists of roles as values
     Output: an attribute DataFrame that gives 1 if a hero takes on a role, and 0 otherwise
     '''
-    total_roles = []
-    for roles in hero_roles.itervalues():
-        total_roles += roles
-    total_roles = sorted(list(set(total_roles) - {'Pusher', 'Ranged', 'Melee', 'Durable', 'Escape', 'Jungler', 'Nuker'}))
+    # One row per (hero, role) pair, so the attribute DataFrame is a single crosstab of heros against roles
+    hero_role_pairs = pd.Series(hero_roles).explode()
+    total_roles = sorted(set(hero_role_pairs.dropna()) - {'Pusher', 'Ranged', 'Melee', 'Durable', 'Escape', 'Jungler', 'Nuker'})
+    hero_role_pairs = hero_role_pairs[hero_role_pairs.isin(total_roles)]
     num_heros = len(hero_roles)-1
-    hero_attribute_df = pd.DataFrame(index=range(num_heros), columns=total_roles)
-    for hero_index in xrange(num_heros):
-        hero_attribute_df.iloc[hero_index] = [1 if role in hero_roles[hero_index] else 0 for role in total_roles]
-    return hero_attribute_df
+    hero_attribute_df = pd.crosstab(hero_role_pairs.index, hero_role_pairs.values)\
+                          .reindex(index=range(num_heros), columns=total_roles, fill_value=0)
+    return hero_attribute_df.rename_axis(index=None, columns=None).astype(np.uint8)
 
 def construct_hard_coded_hero_attribute_df(filepath='dota-2-matches/hero_attributes.csv'):
     '''
@@ -215,9 +263,15 @@ def get_interaction_terms(hero_composition_df):
     Input: hero composition DataFrame
     Output: expanded hero composition DataFrame with all interaction terms included
     '''
-    for interaction_term in combinations(hero_composition_df.columns.tolist(), 2):
-        hero_composition_df[interaction_term[0]+'-x-'+interaction_term[1]] = hero_composition_df[interaction_term[0]] * hero_composition_df[interaction_term[1]]
-    return hero_composition_df
+    # Every pair of columns, in the same order as combinations(columns, 2), multiplied in one broadcast.
+    # The input dtype carries through, the uint8 role counts from construct_hero_composition_df only reach 5 * 5 = 25
+    compositions = hero_composition_df.values
+    first_terms, second_terms = np.triu_indices(compositions.shape[1], k=1)
+    columns = hero_composition_df.columns.tolist()
+    interaction_terms = [columns[i]+'-x-'+columns[j] for i, j in zip(first_terms, second_terms)]
+    interaction_df = pd.DataFrame(compositions[:, first_terms] * compositions[:, second_terms],
+                                  index=hero_composition_df.index, columns=interaction_terms)
+    return pd.concat([hero_composition_df, interaction_df], axis=1)
 
 def construct_ten_min_firstblood_df(objectives_df):
     '''
@@ -238,9 +292,14 @@ def get_game_hero_info(players_df, hero_attribute_df):
     Output: reduced hero info for each game, includes match number, player position,
             whether the player is on radiant or not and the main role of the hero selected
     '''
-    major_roles = hero_attribute_df.apply(np.argmax, axis=1)
+    # Roles are kept as a categorical, role_code holds its 1 byte integer codes for the comparisons further down
+    role_categories = pd.CategoricalDtype(sorted(hero_attribute_df.columns))
+    # Main role of every hero in one argmax over the attribute matrix, then a plain array gather by hero_id - 1
+    major_role_codes = role_categories.categories.get_indexer(hero_attribute_df.columns)[
+                       np.argmax(hero_attribute_df.values, axis=1)].astype(np.int8)
     game_hero_info_df = players_df[['match_id', 'hero_id', 'player_slot', 'radiant_player']].copy()
-    game_hero_info_df['role'] = major_roles.iloc[game_hero_info_df.hero_id].reset_index(drop=True)
+    game_hero_info_df['role_code'] = major_role_codes[game_hero_info_df['hero_id'].values - 1]
+    game_hero_info_df['role'] = pd.Categorical.from_codes(game_hero_info_df['role_code'].values, dtype=role_categories)
     return game_hero_info_df
 
 def construct_role_check_df(game_hero_info_df):
@@ -249,19 +308,12 @@ def construct_role_check_df(game_hero_info_df):
     Output: check whether each team in every game has too many carries, 1 for yes, 0 otherwise
     '''
     checked_too_many_roles = ['too_many_of_one_radiant', 'too_many_of_one_dire']
-    role_check_raw = game_hero_info_df.groupby('match_id').apply(get_too_many_roles).apply(pd.Series).values
-    return pd.DataFrame(role_check_raw, index=range(50000), columns=checked_too_many_roles)
-
-def get_too_many_roles(single_game_hero_info):
-    '''
-    Input: reduced hero info for one single game
-    Output: check whether there are too many of one role => [Carry, Support(merged from Hard and Farm Support), Offlane, Mid]
-    '''
-    radiant_count = single_game_hero_info[single_game_hero_info.radiant_player].role.value_counts().to_dict()
-    dire_count = single_game_hero_info[~single_game_hero_info.radiant_player].role.value_counts().to_dict()
-    radiant_check = int(max(radiant_count.values()) >= 3)
-    dire_check = int(max(dire_count.values()) >= 3)
-    return [radiant_check, dire_check]
+    # Too many of one role => [Carry, Support(merged from Hard and Farm Support), Offlane, Mid] means that the most
+    # common role of a team shows up at least 3 times
+    role_counts = game_hero_info_df.groupby(['match_id', 'radiant_player', 'role_code'], sort=False).size()
+    max_role_count = role_counts.groupby(level=['match_id', 'radiant_player']).max().unstack('radiant_player', fill_value=0)
+    max_role_count = max_role_count.reindex(index=range(50000), columns=[True, False], fill_value=0)
+    return pd.DataFrame((max_role_count.values >= 3).astype(np.uint8), index=range(50000), columns=checked_too_many_roles)
 
 def construct_long_player_gold_df(ten_min_max_wealth):
     '''
@@ -269,10 +321,16 @@ def construct_long_player_gold_df(ten_min_max_wealth):
     Output: long formatted DataFrame that unpivots the gold columns (for every player) onto the match_id column.
             This will be merged with the game_hero_info_df
     '''
-    long_player_gold_df = pd.melt(ten_min_max_wealth.iloc[:, 0::3].reset_index(), id_vars='match_id', var_name='player_slot',
-                                  value_name='max_gold')
-    long_player_gold_df['player_slot'] = long_player_gold_df['player_slot'].apply(lambda string: int(string.split('_')[-1]))
-    return long_player_gold_df.sort_values(by=['match_id', 'player_slot']).reset_index(drop=True)
+    gold_block = ten_min_max_wealth.iloc[:, 0::3]
+    num_matches, num_players = gold_block.shape
+    # The player slots (0-4 for radiant, 128-132 for dire) only have to be read once from the gold column names
+    player_slots = np.array([int(column.split('_')[-1]) for column in gold_block.columns])
+    sort_order = np.argsort(player_slots, kind='stable')
+    # Raveling the row-major gold block already gives the rows sorted by match_id and player_slot
+    long_player_gold_df = pd.DataFrame({'match_id': np.repeat(gold_block.index.values, num_players),
+                                        'player_slot': np.tile(player_slots[sort_order], num_matches),
+                                        'max_gold': gold_block.values[:, sort_order].ravel()})
+    return long_player_gold_df
 
 def construct_role_gold_interaction_df(game_hero_info_df, long_player_gold_df):
     '''
@@ -281,8 +339,9 @@ def construct_role_gold_interaction_df(game_hero_info_df, long_player_gold_df):
             mean max gold of their match
     '''
     hero_gold_info = game_hero_info_df.merge(long_player_gold_df, on=['match_id', 'player_slot'])
-    hero_gold_avg_comp = hero_gold_info.groupby('match_id')['max_gold'].apply(lambda hero_gold: hero_gold - hero_gold.mean())
-    return hero_gold_info.join(hero_gold_avg_comp, rsuffix='_diff_from_match_mean')
+    mean_max_gold_by_match = hero_gold_info.groupby('match_id')['max_gold'].transform('mean')
+    hero_gold_info['max_gold_diff_from_match_mean'] = hero_gold_info['max_gold'] - mean_max_gold_by_match
+    return hero_gold_info
 
 def construct_carry_comparison_df(role_gold_interaction_df):
     '''
@@ -290,44 +349,32 @@ def construct_carry_comparison_df(role_gold_interaction_df):
     Output: return two columns that tells whether Radiant or Dire carry is in the lead in terms of net_wealth
             Only compares in the case where each team has at least one carry
     '''
-    carry_status_comparison = role_gold_interaction_df.groupby('match_id').apply(get_carry_comparison)
-    carry_status_df = pd.DataFrame(carry_status_comparison, columns=['carry_status_comparison'])
+    role_categories = role_gold_interaction_df['role'].cat.categories
+    if 'Carry' in role_categories:
+        carries = role_gold_interaction_df[role_gold_interaction_df['role_code'].values == role_categories.get_loc('Carry')]
+    else:
+        # Without a Carry role in the hero attributes no team has a carry, so every match is -1
+        carries = role_gold_interaction_df.iloc[:0]
+    carry_max_gold = carries.groupby(['match_id', 'radiant_player'])['max_gold_diff_from_match_mean'].max()\
+                            .unstack('radiant_player').reindex(columns=[True, False])
+    # -1 if either of the team does not have a carry, 1 if Radiant carry's max gold is greater than that of Dire carry,
+    # otherwise 0
+    carry_status_comparison = pd.Series(np.where(carry_max_gold.isna().any(axis=1), -1,
+                                                 (carry_max_gold[True] > carry_max_gold[False]).astype(int)),
+                                        index=carry_max_gold.index).reindex(range(50000), fill_value=-1)
+    carry_status_df = pd.DataFrame({'carry_status_comparison': carry_status_comparison})
     dummies = pd.get_dummies(carry_status_df.carry_status_comparison).rename(
                              columns={-1:'Unknown', 0:'Dire_lead', 1:'Radiant_lead'})
-    return dummies[['Radiant_lead', 'Dire_lead']]
-
-def get_carry_comparison(single_game_role_status):
-    '''
-    Input: role and gold interaction info for a single game
-    Output: return -1 if either of the team does not have a carry
-            return 1 if Radiant carry's max gold is greater than that of Dire carry
-            otherwise return 0
-    '''
-    carries_of_the_match = single_game_role_status[single_game_role_status.role == 'Carry']
-    if len(carries_of_the_match['radiant_player'].unique()) < 2:
-        return -1
-    radiant_carries = carries_of_the_match[carries_of_the_match.radiant_player]
-    dire_carries = carries_of_the_match[~carries_of_the_match.radiant_player]
-    if radiant_carries['max_gold_diff_from_match_mean'].max() > dire_carries['max_gold_diff_from_match_mean'].max():
-        return 1
-    else:
-        return 0
+    # A status that never shows up (e.g. no carries at all) still gets its column, filled with False
+    return dummies.reindex(columns=['Radiant_lead', 'Dire_lead'], fill_value=False)
 
 def construct_max_gold_comparison(role_gold_interaction_df):
     '''
     Input: role and gold interaction DataFrame generated from hero info and long formatted player gold info
     Output: compare max of max player net wealth from each team, gives 1 if Radiant is greater and 0 otherwise
     '''
-    max_gold_comparison = role_gold_interaction_df.groupby('match_id').apply(get_max_gold_comparison)
-    return pd.DataFrame(max_gold_comparison, columns=['max_gold_comparison'])
-
-def get_max_gold_comparison(single_game_role_status):
-    '''
-    Input: role and gold interaction info for a single game
-    Output: returns 1 if max of max player net wealth from Radiant is higher, and 0 otherwise
-    '''
-    max_gold_both_teams = single_game_role_status.groupby('radiant_player').apply(lambda game: game.max_gold.max())
-    if (max_gold_both_teams.iloc[True] > max_gold_both_teams.iloc[False]):
-        return 1
-    else:
-        return 0
\ No newline at end of file
+    max_gold_both_teams = role_gold_interaction_df.groupby(['match_id', 'radiant_player'])['max_gold'].max()\
+                                                  .unstack('radiant_player').reindex(columns=[True, False])
+    max_gold_comparison = (max_gold_both_teams[True] > max_gold_both_teams[False]).astype(int)
+    # Only matches with player info get a comparison, a filled in 0 would claim a Dire lead that never happened
+    return pd.DataFrame({'max_gold_comparison': max_gold_comparison})